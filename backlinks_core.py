@@ -0,0 +1,460 @@
+import streamlit as st
+import io
+import json
+import requests
+from requests.adapters import HTTPAdapter
+import pandas as pd
+import numpy as np
+from datetime import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+import random
+from threading import Lock
+
+# Configuration du logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+def normalize_url_for_ahrefs(url):
+    """Normalise une URL cible pour l'API Ahrefs (l'encodage est laissé à requests)"""
+    # Supprime les espaces avant et après
+    url = url.strip()
+    
+    # S'assure que l'URL commence par http:// ou https://
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    
+    return url
+
+# Récupération de la clé API depuis les secrets Streamlit
+try:
+    AHREFS_API_KEY = st.secrets["AHREFS_API_KEY"]
+except Exception as e:
+    logger.error("Erreur lors de la récupération de la clé API: %s", e)
+    st.error("La clé API Ahrefs n'est pas configurée correctement.")
+    st.stop()
+
+class RateLimiter:
+    """Classe pour gérer les limites de taux de requêtes API"""
+    def __init__(self, requests_per_second=5, burst=None):
+        self.requests_per_second = requests_per_second
+        self.interval = 1.0 / requests_per_second
+        # Rafale autorisée après une période d'inactivité (par défaut une seconde de requêtes)
+        self.burst = burst or requests_per_second
+        self._burst_window = (self.burst - 1) * self.interval
+        # Heure théorique du prochain créneau régulier ; on peut la devancer d'au plus la rafale
+        self._next_slot = 0.0
+        self._lock = Lock()
+    
+    def wait(self):
+        # Le verrou ne protège que la réservation du créneau ; l'attente se fait hors verrou
+        with self._lock:
+            now = time.monotonic()
+            next_slot = max(now, self._next_slot)
+            sleep_time = next_slot - self._burst_window - now
+            self._next_slot = next_slot + self.interval
+        
+        if sleep_time > 0:
+            time.sleep(sleep_time)
+    
+    def pause(self, seconds):
+        """Repousse le prochain créneau de tous les appelants (ex. Retry-After de l'API)"""
+        with self._lock:
+            self._next_slot = max(self._next_slot, time.monotonic() + seconds + self._burst_window)
+
+rate_limiter = RateLimiter()
+
+AHREFS_API_URL = "https://api.ahrefs.com"
+AHREFS_BACKLINKS_PATH = "/v3/site-explorer/all-backlinks"
+AHREFS_BACKLINKS_STATS_PATH = "/v3/site-explorer/backlinks-stats"
+# Délais (connexion, lecture) en secondes
+AHREFS_TIMEOUT = (5, 30)
+# Durées de vie des caches d'API (secondes) selon la volatilité des données : les backlinks
+# de la cible sont rafraîchis toutes les heures, ceux de notre domaine changent lentement.
+# Les statistiques Tier 2, persistées, sont renouvelées chaque jour par la date de leur clé.
+BACKLINKS_CACHE_TTL = 3600
+OUR_DOMAIN_CACHE_TTL = 6 * 3600
+# Nombre maximal de tentatives par requête (erreurs réseau, 429 et 5xx uniquement)
+AHREFS_MAX_ATTEMPTS = 3
+# Nombre de requêtes Tier 2 en vol ; le pool HTTP est dimensionné en conséquence. Le débit réel
+# reste plafonné par le RateLimiter : 10 workers le maintiennent à 5 req/s même à ~2 s de latence.
+TIER2_MAX_WORKERS = 10
+
+# Colonnes demandées à l'API (select=) et types associés dans le DataFrame.
+# Les types Arrow sont repris tels quels par st.dataframe, sans conversion colonne par colonne.
+BACKLINK_COLUMNS = ['domain_rating_source', 'url_from', 'first_seen', 'link_type']
+BACKLINK_DTYPES = {
+    'url_from': 'string[pyarrow]',
+    'link_type': 'category'
+}
+
+@st.cache_resource
+def get_ahrefs_session():
+    """Session HTTP partagée pour réutiliser les connexions (keep-alive) vers l'API Ahrefs"""
+    session = requests.Session()
+    session.headers.update({
+        'Accept': "application/json",
+        'Authorization': f"Bearer {AHREFS_API_KEY}"
+    })
+    # Une connexion conservée par worker : aucune n'est fermée faute de place dans le pool
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=TIER2_MAX_WORKERS))
+    return session
+
+class AhrefsAPIError(Exception):
+    """Erreur lors d'un appel à l'API Ahrefs"""
+
+class TransientAhrefsError(AhrefsAPIError):
+    """Erreur passagère (réseau, 429, 5xx) : la requête peut être retentée"""
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        # Délai imposé par l'API (Retry-After) avant la prochaine tentative, en secondes
+        self.retry_after = retry_after
+
+class AhrefsClientError(AhrefsAPIError):
+    """Erreur client (4xx hors 429) : inutile de retenter la même requête"""
+
+def parse_retry_after(value, default=4):
+    """Délai en secondes de l'en-tête Retry-After, ou la valeur par défaut s'il est absent ou illisible"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
+
+def send_ahrefs_request(endpoint, params):
+    """Effectue une requête unique à l'API Ahrefs et lève une erreur typée en cas d'échec"""
+    logger.debug("Requête API Ahrefs - Endpoint: %s, paramètres: %s", endpoint, params)
+    rate_limiter.wait()
+    
+    try:
+        # Paramètres encodés par requests (caractères réservés et non ASCII compris)
+        response = get_ahrefs_session().get(
+            f"{AHREFS_API_URL}{endpoint}",
+            params=params,
+            timeout=AHREFS_TIMEOUT
+        )
+    except requests.RequestException as e:
+        logger.error("Erreur HTTP lors de la requête: %s", e)
+        raise TransientAhrefsError(f"Erreur HTTP: {str(e)}")
+    
+    logger.debug("Statut de la réponse: %s", response.status_code)
+    
+    if response.status_code == 200:
+        logger.debug("Taille de la réponse: %d octets", len(response.content))
+        try:
+            return json.loads(response.content)
+        except json.JSONDecodeError as e:
+            logger.error("Erreur de décodage JSON: %s", e)
+            raise AhrefsAPIError(f"Erreur de décodage JSON: {str(e)}")
+    
+    error_msg = response.text
+    logger.error("Erreur API (Status %s): %s", response.status_code, error_msg)
+    message = f"Erreur API (Status {response.status_code}): {error_msg}"
+    
+    if response.status_code == 429:
+        raise TransientAhrefsError(message, parse_retry_after(response.headers.get('Retry-After')))
+    if response.status_code >= 500:
+        raise TransientAhrefsError(message)
+    raise AhrefsClientError(message)
+
+def make_ahrefs_request(endpoint, params):
+    """Fonction générique pour faire des requêtes à l'API Ahrefs avec retry"""
+    for attempt in range(1, AHREFS_MAX_ATTEMPTS + 1):
+        try:
+            return send_ahrefs_request(endpoint, params)
+        except TransientAhrefsError as e:
+            # Seules les erreurs passagères sont retentées ; les erreurs client remontent directement
+            if attempt == AHREFS_MAX_ATTEMPTS:
+                raise
+            
+            if e.retry_after is not None:
+                # Limite de taux atteinte : délai indiqué par l'API, appliqué à tous les workers
+                rate_limiter.pause(e.retry_after)
+            else:
+                # Attente exponentielle entre deux tentatives : 4 s, 8 s, plafonnée à 10 s,
+                # avec une part aléatoire pour que les workers ne relancent pas tous ensemble
+                time.sleep(min(10, 4 * 2 ** (attempt - 1)) + random.uniform(0, 0.5))
+
+@st.cache_data(ttl=BACKLINKS_CACHE_TTL, max_entries=100, show_spinner=False)
+def get_backlinks_cached(target_url, limit=100, mode="subdomains", aggregation="all"):
+    """Version mise en cache de la requête de backlinks"""
+    try:
+        logger.debug("Début de get_backlinks_cached pour URL: %s", target_url)
+        
+        params = {
+            'limit': limit,
+            'select': ','.join(BACKLINK_COLUMNS),
+            'target': normalize_url_for_ahrefs(target_url),
+            'mode': mode,
+            'history': 'live',
+            'aggregation': aggregation
+        }
+        
+        logger.debug("Paramètres de la requête: %s", params)
+        
+        result = make_ahrefs_request(AHREFS_BACKLINKS_PATH, params)
+        
+        if not result:
+            raise AhrefsAPIError("Aucun résultat retourné par l'API")
+            
+        logger.debug("Résultat reçu avec %d backlinks", len(result.get('backlinks', [])))
+        return result
+        
+    except AhrefsAPIError as e:
+        # Exception typée propagée telle quelle : l'appelant distingue erreurs passagères et client
+        logger.error("Erreur dans get_backlinks_cached: %s", e)
+        raise
+    except Exception as e:
+        logger.error("Erreur dans get_backlinks_cached: %s", e)
+        raise AhrefsAPIError(f"Erreur lors de la récupération des backlinks: {str(e)}") from e
+
+# Cache persisté sur disque pour survivre aux redémarrages du serveur. Streamlit ignore le TTL
+# des caches persistés : la date des statistiques fait partie de la clé, ce qui renouvelle
+# les entrées chaque jour, et purge_stale_tier2_cache supprime celles des jours précédents.
+# Les erreurs ne sont pas mises en cache (exception propagée).
+@st.cache_data(persist="disk", max_entries=10000, show_spinner=False)
+def get_tier2_stats_cached(url, stats_date):
+    """Version mise en cache des statistiques de niveau 2 d'une URL à une date donnée"""
+    params = {'target': url, 'mode': 'exact', 'date': stats_date}
+    
+    stats = make_ahrefs_request(AHREFS_BACKLINKS_STATS_PATH, params)
+    
+    if not stats or 'metrics' not in stats:
+        logger.warning("Pas de métriques trouvées pour %s", url)
+        return 0, 0
+        
+    live_backlinks = stats['metrics'].get('live', 0)
+    live_refdomains = stats['metrics'].get('live_refdomains', 0)
+    logger.debug("Tier 2 %s : %s liens live, %s domaines référents", url, live_backlinks, live_refdomains)
+    
+    return live_backlinks, live_refdomains
+
+@st.cache_data(persist="disk", show_spinner=False)
+def get_tier2_cache_date():
+    """Date des entrées du cache de niveau 2 sur disque, persistée avec elles"""
+    return datetime.now().strftime("%Y-%m-%d")
+
+def purge_stale_tier2_cache(stats_date):
+    """Vide le cache disque de niveau 2 quand ses entrées datent d'un jour précédent"""
+    if get_tier2_cache_date() != stats_date:
+        logger.info("Purge du cache de niveau 2 antérieur au %s", stats_date)
+        get_tier2_stats_cached.clear()
+        get_tier2_cache_date.clear()
+        get_tier2_cache_date()
+
+def backlinks_to_dataframe(backlinks):
+    """Construit le DataFrame des backlinks avec un schéma et des types explicites"""
+    df = pd.DataFrame.from_records(backlinks, columns=BACKLINK_COLUMNS).astype(BACKLINK_DTYPES)
+    
+    # Le DR tient sur un octet non signé (0-100) : toutes les analyses parcourent moins de mémoire
+    df['domain_rating_source'] = pd.to_numeric(df['domain_rating_source'], downcast='unsigned')
+    
+    # Dates ISO 8601 de l'API converties une seule fois en datetime64 UTC (même type si la liste est vide)
+    df['first_seen'] = pd.to_datetime(df['first_seen'], format='ISO8601', utc=True)
+    
+    return df
+
+def analyze_tier2_links_parallel(df, progress_bar, status_text):
+    """Analyse parallèle des liens de niveau 2"""
+    # Une seule requête par URL source distincte ; url_codes replace les résultats sur chaque ligne
+    url_codes, unique_urls = pd.factorize(df['url_from'])
+    total_urls = len(unique_urls)
+    
+    # Résultats rangés par position d'URL distincte (0 en cas d'erreur), réduits une fois remplis
+    unique_live_links = np.zeros(total_urls, dtype=np.int64)
+    unique_live_refdomains = np.zeros(total_urls, dtype=np.int64)
+    
+    stats_date = datetime.now().strftime("%Y-%m-%d")
+    purge_stale_tier2_cache(stats_date)
+    
+    def process_url(url):
+        try:
+            # Conversion dans le try : une valeur nulle ou invalide ne met à 0 que cette URL
+            live_links, live_refdomains = get_tier2_stats_cached(url, stats_date)
+            return int(live_links or 0), int(live_refdomains or 0)
+        except Exception as e:
+            logger.error("Erreur lors de l'analyse de %s: %s", url, e)
+            return 0, 0
+    
+    with ThreadPoolExecutor(max_workers=TIER2_MAX_WORKERS) as executor:
+        # Itération sur une liste Python plutôt que sur l'Index pandas
+        future_positions = {
+            executor.submit(process_url, url): position
+            for position, url in enumerate(unique_urls.tolist())
+        }
+        
+        # Résultats traités dès qu'ils arrivent ; interface mise à jour par paliers d'environ 1 %
+        report_step = max(1, total_urls // 100)
+        for processed_count, future in enumerate(as_completed(future_positions), start=1):
+            position = future_positions[future]
+            unique_live_links[position], unique_live_refdomains[position] = future.result()
+            
+            if processed_count % report_step == 0:
+                progress_bar.progress(processed_count / total_urls)
+                status_text.text(f"Analyse de l'URL {processed_count}/{total_urls}")
+    
+    progress_bar.progress(1.0)
+    status_text.text(f"Analyse terminée! {total_urls}/{total_urls} URLs traitées")
+    
+    # Type non signé le plus étroit possible, comme pour le DR ; int64 conservé si une valeur est négative
+    unique_live_links = pd.to_numeric(unique_live_links, downcast='unsigned')
+    unique_live_refdomains = pd.to_numeric(unique_live_refdomains, downcast='unsigned')
+    
+    return unique_live_links[url_codes], unique_live_refdomains[url_codes]
+
+# Bornes basses des tranches de DR (hors première tranche) et libellés associés
+DR_RANGE_EDGES = np.array([30, 45, 60])
+DR_RANGE_LABELS = ('DR 0-29', 'DR 30-44', 'DR 45-59', 'DR 60-100')
+
+def analyze_dr_distribution(dr_values):
+    """Analyse la distribution des Domain Ratings à partir du tableau NumPy des DR"""
+    # DR manquants ignorés, comme avec les anciens filtres par tranche
+    if dr_values.dtype.kind == 'f':
+        dr_values = dr_values[~np.isnan(dr_values)]
+    
+    # Indice de tranche de chaque DR puis comptage, sans Categorical intermédiaire
+    dr_ranges = np.searchsorted(DR_RANGE_EDGES, dr_values, side='right')
+    counts = np.bincount(dr_ranges, minlength=len(DR_RANGE_LABELS))
+    
+    return dict(zip(DR_RANGE_LABELS, counts.tolist()))
+
+def analyze_yearly_distribution(df):
+    """Analyse la distribution des backlinks par année"""
+    # Années calculées localement : le DataFrame affiché et exporté n'est pas modifié.
+    # Les dates manquantes sont ignorées pour garder des années entières.
+    years = df['first_seen'].dropna().dt.year.to_numpy()
+    
+    if len(years) == 0:
+        return pd.DataFrame({
+            'Année': np.array([], dtype=np.int64),
+            '# de liens': np.array([], dtype=np.int64),
+            'CUMULÉS': np.array([], dtype=np.int64)
+        })
+    
+    # Comptage par année en un seul passage, déjà trié par année
+    first_year = years.min()
+    yearly_counts = np.bincount(years - first_year)
+    present_years = np.flatnonzero(yearly_counts)
+    
+    return pd.DataFrame({
+        'Année': present_years + first_year,
+        '# de liens': yearly_counts[present_years],
+        'CUMULÉS': np.cumsum(yearly_counts[present_years])
+    })
+
+# Bornes basses des tranches de liens de niveau 2 (hors première tranche) et libellés associés
+TIER_RANGE_EDGES = np.array([1, 4, 11])
+TIER_RANGE_LABELS = ('0', '1-3', '4-10', '11+')
+
+def analyze_tier_distributions(df, column_names):
+    """Analyse la distribution des Tiers de plusieurs colonnes en un seul passage"""
+    n_ranges = len(TIER_RANGE_LABELS)
+    present_columns = [column for column in column_names if column in df.columns]
+    counts_by_column = {}
+    
+    if present_columns:
+        # Indice de tranche de chaque valeur, décalé par colonne : un seul comptage pour toutes
+        tier_ranges = np.searchsorted(TIER_RANGE_EDGES, df[present_columns].to_numpy(), side='right')
+        tier_ranges += np.arange(len(present_columns)) * n_ranges
+        counts = np.bincount(tier_ranges.ravel(), minlength=len(present_columns) * n_ranges)
+        counts_by_column = dict(zip(present_columns, counts.reshape(-1, n_ranges).tolist()))
+    
+    return [
+        {
+            f'{label} {column}': count
+            for label, count in zip(TIER_RANGE_LABELS, counts_by_column.get(column, [0] * n_ranges))
+        }
+        for column in column_names
+    ]
+
+def distribution_table(distribution, name='Backlinks'):
+    """Met en forme une distribution en une table d'une ligne, affichée en un seul élément"""
+    return pd.Series(distribution, name=name).to_frame().T
+
+def get_max_metrics(df):
+    """Obtient les métriques maximales"""
+    max_tier = df['tier2_live_links'].max() if len(df) > 0 and 'tier2_live_links' in df.columns else 0
+    
+    # DR manquants ignorés, comme dans analyze_dr_distribution
+    dr_values = df['domain_rating_source']
+    
+    if dr_values.isna().all():
+        return {
+            'max_dr': 0,
+            'max_tier': max_tier,
+            'max_dr_url': '',
+            'max_dr_value': 0
+        }
+    
+    # Un seul parcours positionnel de la colonne DR
+    max_dr_pos = int(dr_values.argmax(skipna=True))
+    max_dr = dr_values.iat[max_dr_pos]
+    
+    return {
+        'max_dr': max_dr,
+        'max_tier': max_tier,
+        'max_dr_url': df['url_from'].iat[max_dr_pos],
+        'max_dr_value': max_dr
+    }
+
+def create_yearly_plot(yearly_data, title="Nombre de domaines Référents par années"):
+    """Crée un graphique des backlinks par année"""
+    # Import différé : plotly n'est chargé qu'au premier graphique affiché
+    import plotly.graph_objects as go
+    
+    fig = go.Figure()
+    
+    fig.add_trace(
+        go.Scatter(
+            x=yearly_data['Année'],
+            y=yearly_data['# de liens'],
+            name='# de backlinks',
+            mode='lines+markers'
+        )
+    )
+    
+    fig.update_layout(
+        title=title,
+        xaxis_title='Année',
+        yaxis_title='Nombre de backlinks',
+        height=400,
+        showlegend=True
+    )
+    
+    return fig
+
+@st.cache_data(ttl=BACKLINKS_CACHE_TTL, max_entries=100, show_spinner=False)
+def analyze_backlinks_cached(target_url, limit=100, mode="subdomains", aggregation="all"):
+    """Version mise en cache du pipeline d'analyse : DataFrame, distributions et graphique"""
+    result = get_backlinks_cached(target_url, limit, mode, aggregation)
+    
+    if not result or 'backlinks' not in result:
+        return None
+    
+    df = backlinks_to_dataframe(result['backlinks'])
+    yearly_data = analyze_yearly_distribution(df)
+    
+    # Tableau contigu extrait une seule fois pour les analyses sur le DR
+    dr_values = df['domain_rating_source'].to_numpy()
+    
+    return {
+        'df': df,
+        'yearly_data': yearly_data,
+        'yearly_plot': create_yearly_plot(yearly_data),
+        'dr_distribution': analyze_dr_distribution(dr_values)
+    }
+
+@st.cache_data(max_entries=20, show_spinner=False)
+def dataframe_to_csv(df):
+    """Version mise en cache de l'export CSV du DataFrame"""
+    # Format d'export inchangé pour les utilisateurs : DR en flottant comme renvoyé par l'API
+    # et dates au format ISO 8601 d'Ahrefs plutôt que la représentation datetime de pandas
+    export_df = df.astype({'domain_rating_source': 'float64'}) if 'domain_rating_source' in df.columns else df
+    
+    # Écriture directe en octets : pas de chaîne intermédiaire à réencoder
+    buffer = io.BytesIO()
+    export_df.to_csv(buffer, index=False, encoding='utf-8', date_format='%Y-%m-%dT%H:%M:%SZ')
+    return buffer.getvalue()
@@ -1,275 +1,19 @@
 import streamlit as st
-import http.client
-import json
-import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime
+from functools import partial
 import logging
-import plotly.graph_objects as go
-from concurrent.futures import ThreadPoolExecutor
-import time
-from tenacity import retry, stop_after_attempt, wait_exponential
 
-# Configuration du logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+from backlinks_core import (
+    normalize_url_for_ahrefs,
+    analyze_backlinks_cached,
+    analyze_tier2_links_parallel,
+    analyze_tier_distributions,
+    distribution_table,
+    get_max_metrics,
+    dataframe_to_csv,
 )
-logger = logging.getLogger(__name__)
-
-# Récupération de la clé API depuis les secrets Streamlit
-try:
-    AHREFS_API_KEY = st.secrets["AHREFS_API_KEY"]
-except Exception as e:
-    logger.error(f"Erreur lors de la récupération de la clé API: {str(e)}")
-    st.error("La clé API Ahrefs n'est pas configurée correctement.")
-    st.stop()
-
-class RateLimiter:
-    """Classe pour gérer les limites de taux de requêtes API"""
-    def __init__(self, requests_per_second=5):
-        self.requests_per_second = requests_per_second
-        self.requests = []
-    
-    def wait(self):
-        now = datetime.now()
-        # Nettoyer les anciennes requêtes
-        self.requests = [req for req in self.requests 
-                        if now - req < timedelta(seconds=1)]
-        
-        # Si trop de requêtes, attendre
-        if len(self.requests) >= self.requests_per_second:
-            sleep_time = 1.0 - (now - self.requests[0]).total_seconds()
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-        
-        self.requests.append(now)
-
-rate_limiter = RateLimiter()
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-def make_ahrefs_request(endpoint, headers):
-    """Fonction générique pour faire des requêtes à l'API Ahrefs avec retry"""
-    try:
-        rate_limiter.wait()
-        conn = http.client.HTTPSConnection("api.ahrefs.com")
-        
-        logger.info(f"Requête API Ahrefs - Endpoint: {endpoint}")
-        conn.request("GET", endpoint, headers=headers)
-        
-        response = conn.getresponse()
-        data = response.read()
-        
-        logger.info(f"Statut de la réponse: {response.status}")
-        
-        if response.status == 200:
-            return json.loads(data.decode("utf-8"))
-        else:
-            error_msg = data.decode("utf-8")
-            logger.error(f"Erreur API: {error_msg}")
-            raise Exception(f"Erreur API: {error_msg}")
-    finally:
-        conn.close()
-
-@st.cache_data(ttl=3600)
-def get_backlinks_cached(target_url, limit=100, mode="subdomains", aggregation="all"):
-    """Version mise en cache de la requête de backlinks"""
-    headers = {
-        'Accept': "application/json",
-        'Authorization': f"Bearer {AHREFS_API_KEY}"
-    }
-    
-    encoded_url = target_url.replace(':', '%3A').replace('/', '%2F')
-    endpoint = (f"/v3/site-explorer/all-backlinks?"
-               f"limit={limit}&"
-               f"select=domain_rating_source,url_from,first_seen,link_type&"
-               f"target={encoded_url}&"
-               f"mode={mode}&"
-               f"history=live&"
-               f"aggregation={aggregation}")
-    
-    return make_ahrefs_request(endpoint, headers)
-
-@st.cache_data(ttl=3600)
-@st.cache_data(ttl=3600)
-def get_tier2_stats_cached(url):
-    """Version mise en cache des statistiques de niveau 2 avec meilleure gestion des erreurs"""
-    try:
-        headers = {
-            'Accept': "application/json",
-            'Authorization': f"Bearer {AHREFS_API_KEY}"
-        }
-        
-        current_date = datetime.now().strftime("%Y-%m-%d")
-        encoded_url = url.replace(':', '%3A').replace('/', '%2F')
-        endpoint = f"/v3/site-explorer/backlinks-stats?target={encoded_url}&mode=exact&date={current_date}"
-        
-        stats = make_ahrefs_request(endpoint, headers)
-        
-        if not stats or 'metrics' not in stats:
-            logger.warning(f"Pas de métriques trouvées pour {url}")
-            return 0, 0
-            
-        live_backlinks = stats['metrics'].get('live', 0)
-        live_refdomains = stats['metrics'].get('live_refdomains', 0)
-        
-        return live_backlinks, live_refdomains
-        
-    except Exception as e:
-        logger.error(f"Erreur lors de l'analyse Tier 2 pour {url}: {str(e)}")
-        return 0, 0
-
-def analyze_tier2_links_parallel(df, progress_bar, status_text):
-    """Analyse parallèle des liens de niveau 2 avec gestion correcte du contexte Streamlit"""
-    tier2_results = []
-    total_urls = len(df)
-    
-    # On utilise un compteur thread-safe
-    from threading import Lock
-    processed_lock = Lock()
-    processed_count = 0
-    
-    def process_url(url):
-        nonlocal processed_count
-        try:
-            result = get_tier2_stats_cached(url)
-            
-            # Mise à jour thread-safe du compteur
-            with processed_lock:
-                nonlocal processed_count
-                processed_count += 1
-                
-                # On évite d'appeler les éléments Streamlit directement depuis le thread
-                current_progress = processed_count / total_urls
-                
-            return result
-        except Exception as e:
-            logger.error(f"Erreur lors de l'analyse de {url}: {str(e)}")
-            return (0, 0)
-    
-    # Exécution parallèle
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [executor.submit(process_url, url) for url in df['url_from']]
-        
-        # Mise à jour de la barre de progression dans le thread principal
-        while any(not f.done() for f in futures):
-            current_progress = processed_count / total_urls
-            progress_bar.progress(current_progress)
-            status_text.text(f"Analyse de l'URL {processed_count}/{total_urls}")
-            time.sleep(0.1)
-        
-        # Récupération des résultats
-        tier2_results = [f.result() for f in futures]
-    
-    # Mise à jour finale de la progression
-    progress_bar.progress(1.0)
-    status_text.text(f"Analyse terminée! {total_urls}/{total_urls} URLs traitées")
-    
-    # Séparation des résultats en deux listes
-    tier2_live_links, tier2_live_refdomains = zip(*tier2_results)
-    return list(tier2_live_links), list(tier2_live_refdomains)
-
-def analyze_dr_distribution(df):
-    """Analyse la distribution des Domain Ratings"""
-    dr_ranges = {
-        'DR 0-29': (0, 29),
-        'DR 30-44': (30, 44),
-        'DR 45-59': (45, 59),
-        'DR 60-100': (60, 100)
-    }
-    
-    distribution = {}
-    for range_name, (min_dr, max_dr) in dr_ranges.items():
-        count = len(df[(df['domain_rating_source'] >= min_dr) & 
-                      (df['domain_rating_source'] <= max_dr)])
-        distribution[range_name] = count
-    
-    return distribution
-
-def analyze_yearly_distribution(df):
-    """Analyse la distribution des backlinks par année"""
-    df['year'] = pd.to_datetime(df['first_seen']).dt.year
-    yearly_counts = df['year'].value_counts().sort_index()
-    cumulative_counts = yearly_counts.cumsum()
-    
-    yearly_data = pd.DataFrame({
-        'Année': yearly_counts.index,
-        '# de liens': yearly_counts.values,
-        'CUMULÉS': cumulative_counts.values
-    })
-    
-    return yearly_data.sort_values('Année')
-
-def analyze_tier_distribution(df, column_name):
-    """Analyse la distribution des Tiers"""
-    if column_name not in df.columns:
-        return {
-            f'0 {column_name}': 0,
-            f'1-3 {column_name}': 0,
-            f'4-10 {column_name}': 0,
-            f'11+ {column_name}': 0
-        }
-    
-    tier_ranges = {
-        f'0 {column_name}': (0, 0),
-        f'1-3 {column_name}': (1, 3),
-        f'4-10 {column_name}': (4, 10),
-        f'11+ {column_name}': (11, float('inf'))
-    }
-    
-    distribution = {}
-    for range_name, (min_links, max_links) in tier_ranges.items():
-        if min_links == max_links:
-            count = len(df[df[column_name] == min_links])
-        elif max_links == float('inf'):
-            count = len(df[df[column_name] >= min_links])
-        else:
-            count = len(df[(df[column_name] >= min_links) & 
-                         (df[column_name] <= max_links)])
-        distribution[range_name] = count
-    
-    return distribution
-
-def get_max_metrics(df):
-    """Obtient les métriques maximales"""
-    if len(df) == 0:
-        return {
-            'max_dr': 0,
-            'max_tier': 0,
-            'max_dr_url': '',
-            'max_dr_value': 0
-        }
-    
-    max_dr_idx = df['domain_rating_source'].idxmax()
-    
-    return {
-        'max_dr': df['domain_rating_source'].max(),
-        'max_tier': df.get('tier2_live_links', [0]).max() if 'tier2_live_links' in df.columns else 0,
-        'max_dr_url': df.loc[max_dr_idx, 'url_from'],
-        'max_dr_value': df.loc[max_dr_idx, 'domain_rating_source']
-    }
-
-def create_yearly_plot(yearly_data):
-    """Crée un graphique des backlinks par année"""
-    fig = go.Figure()
-    
-    fig.add_trace(
-        go.Scatter(
-            x=yearly_data['Année'],
-            y=yearly_data['# de liens'],
-            name='# de backlinks',
-            mode='lines+markers'
-        )
-    )
-    
-    fig.update_layout(
-        title='Nombre de domaines Référents par années',
-        xaxis_title='Année',
-        yaxis_title='Nombre de backlinks',
-        height=400,
-        showlegend=True
-    )
-    
-    return fig
+logger = logging.getLogger(__name__)
 
 def main():
     st.title("📊 Analyse de la Puissance de Netlinking")
@@ -310,10 +54,13 @@ def main():
         if url_input:
             try:
                 with st.spinner("Récupération et analyse des backlinks en cours..."):
-                    result = get_backlinks_cached(url_input, limit, mode, aggregation)
+                    # URL normalisée avant l'appel : « example.com » et « https://example.com »
+                    # partagent la même entrée de cache
+                    target_url = normalize_url_for_ahrefs(url_input)
+                    analysis = analyze_backlinks_cached(target_url, limit, mode, aggregation)
                     
-                    if result and 'backlinks' in result:
-                        df = pd.DataFrame(result['backlinks'])
+                    if analysis:
+                        df = analysis['df']
                         
                         if check_tier2 and len(df) > 0:
                             st.info("Analyse des liens de Niveau 2 en cours...")
@@ -333,7 +80,7 @@ def main():
                         
                         # Distribution temporelle
                         st.subheader("📅 Distribution temporelle des backlinks")
-                        yearly_data = analyze_yearly_distribution(df)
+                        yearly_data = analysis['yearly_data']
                         
                         st.markdown("### # de backlinks créés par année")
                         st.dataframe(
@@ -346,43 +93,40 @@ def main():
                             }
                         )
                         
-                        st.plotly_chart(create_yearly_plot(yearly_data))
+                        st.plotly_chart(analysis['yearly_plot'])
                         
                         # Distribution des DR
                         st.subheader("📊 Nombre de Backlinks en fonction du DR")
-                        dr_distribution = analyze_dr_distribution(df)
-                        cols = st.columns(4)
-                        for i, (range_name, count) in enumerate(dr_distribution.items()):
-                            cols[i].metric(range_name, count)
+                        dr_distribution = analysis['dr_distribution']
+                        st.table(distribution_table(dr_distribution))
                         
                         # Distribution des Tiers
                         if 'tier2_live_links' in df.columns:
                             st.subheader("🔗 Distribution des liens de niveau 2")
                             
+                            # Backlinks et domaines référents comptés en un seul passage
+                            links_distribution, refdomains_distribution = analyze_tier_distributions(
+                                df, ['tier2_live_links', 'tier2_live_refdomains']
+                            )
+                            
                             # Backlinks
-                            links_distribution = analyze_tier_distribution(df, 'tier2_live_links')
-                            cols = st.columns(4)
-                            for i, (range_name, count) in enumerate(links_distribution.items()):
-                                cols[i].metric(
-                                    range_name.replace('tier2_live_links', 'Live backlinks Tier2'),
-                                    count
-                                )
+                            st.table(distribution_table({
+                                range_name.replace('tier2_live_links', 'Live backlinks Tier2'): count
+                                for range_name, count in links_distribution.items()
+                            }))
                             
                             # Referring domains
                             st.subheader("🔗 Distribution des domaines référents de niveau 2")
-                            refdomains_distribution = analyze_tier_distribution(df, 'tier2_live_refdomains')
-                            cols = st.columns(4)
-                            for i, (range_name, count) in enumerate(refdomains_distribution.items()):
-                                cols[i].metric(
-                                    range_name.replace('tier2_live_refdomains', 'RD Tier2'),
-                                    count
-                                )
+                            st.table(distribution_table({
+                                range_name.replace('tier2_live_refdomains', 'RD Tier2'): count
+                                for range_name, count in refdomains_distribution.items()
+                            }))
                         
                         # Métriques maximales
                         st.subheader("🏆 Métriques Maximales")
                         max_metrics = get_max_metrics(df)
                         col1, col2 = st.columns(2)
-                        col1.metric("MAX(Domain Rating)", max_metrics['max_dr'])
+                        col1.metric("MAX(Domain Rating)", f"{max_metrics['max_dr']:.1f}")
                         col2.metric("MAX(Tier2)", max_metrics['max_tier'])
                         
                         # Affichage du backlink le plus puissant
@@ -396,7 +140,10 @@ def main():
                         column_config = {
                             "domain_rating_source": "DR Source",
                             "url_from": "URL Source",
-                            "first_seen": "Première vue",
+                            # Dates affichées au format ISO 8601 d'Ahrefs, comme dans l'export CSV
+                            "first_seen": st.column_config.DatetimeColumn(
+                                "Première vue", format="YYYY-MM-DDTHH:mm:ss[Z]"
+                            ),
                             "link_type": "Type de lien"
                         }
                         
@@ -414,18 +161,18 @@ def main():
                             hide_index=True
                         )
                         
-                        # Bouton d'export CSV
-                        csv = df.to_csv(index=False)
+                        # Bouton d'export CSV : fichier généré au clic, sans relancer le script
                         st.download_button(
                             "💾 Télécharger les données (CSV)",
-                            csv,
+                            partial(dataframe_to_csv, df),
                             f"backlinks_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-                            "text/csv"
+                            "text/csv",
+                            on_click="ignore"
                         )
                     else:
                         st.error("Erreur lors de la récupération des données. Vérifiez l'URL et réessayez.")
             except Exception as e:
-                logger.error(f"Erreur lors de l'analyse: {str(e)}")
+                logger.error("Erreur lors de l'analyse: %s", e)
                 st.error(f"Une erreur s'est produite: {str(e)}")
         else:
             st.warning("Veuillez entrer une URL à analyser.")
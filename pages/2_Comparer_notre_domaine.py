@@ -1,343 +1,53 @@
 import streamlit as st
-import http.client
-import json
 import pandas as pd
-import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime
+from functools import partial
 import logging
-import plotly.graph_objects as go
-from concurrent.futures import ThreadPoolExecutor
-import time
-from tenacity import retry, stop_after_attempt, wait_exponential
-from threading import Lock
-from urllib.parse import quote
 
-# Configuration du logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+from backlinks_core import (
+    AHREFS_BACKLINKS_PATH,
+    OUR_DOMAIN_CACHE_TTL,
+    normalize_url_for_ahrefs,
+    make_ahrefs_request,
+    get_backlinks_cached,
+    analyze_backlinks_cached,
+    analyze_tier2_links_parallel,
+    backlinks_to_dataframe,
+    analyze_tier_distributions,
+    distribution_table,
+    get_max_metrics,
+    dataframe_to_csv,
 )
-logger = logging.getLogger(__name__)
-
-def encode_url_for_ahrefs(url):
-    """Encode correctement une URL pour l'API Ahrefs"""
-    # Supprime les espaces avant et après
-    url = url.strip()
-    
-    # S'assure que l'URL commence par http:// ou https://
-    if not url.startswith(('http://', 'https://')):
-        url = 'https://' + url
-    
-    # Encode l'URL correctement
-    return quote(url, safe='')
-
-# Récupération de la clé API depuis les secrets Streamlit
-try:
-    AHREFS_API_KEY = st.secrets["AHREFS_API_KEY"]
-except Exception as e:
-    logger.error(f"Erreur lors de la récupération de la clé API: {str(e)}")
-    st.error("La clé API Ahrefs n'est pas configurée correctement.")
-    st.stop()
-
-class RateLimiter:
-    """Classe pour gérer les limites de taux de requêtes API"""
-    def __init__(self, requests_per_second=5):
-        self.requests_per_second = requests_per_second
-        self.requests = []
-        self._lock = Lock()
-    
-    def wait(self):
-        with self._lock:
-            now = datetime.now()
-            self.requests = [req for req in self.requests 
-                           if now - req < timedelta(seconds=1)]
-            
-            if len(self.requests) >= self.requests_per_second:
-                sleep_time = 1.0 - (now - self.requests[0]).total_seconds()
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-            
-            self.requests.append(now)
 
-rate_limiter = RateLimiter()
-
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-def make_ahrefs_request(endpoint, headers):
-    """Fonction générique pour faire des requêtes à l'API Ahrefs avec retry"""
-    conn = None
-    try:
-        logger.info(f"Tentative de requête API Ahrefs - Endpoint: {endpoint}")
-        rate_limiter.wait()
-        conn = http.client.HTTPSConnection("api.ahrefs.com", timeout=30)
-        
-        logger.info(f"Envoi de la requête avec headers: {headers}")
-        conn.request("GET", endpoint, headers=headers)
-        
-        logger.info("Attente de la réponse...")
-        response = conn.getresponse()
-        data = response.read()
-        
-        logger.info(f"Statut de la réponse: {response.status}")
-        logger.info(f"Headers de réponse: {response.getheaders()}")
-        
-        if response.status == 200:
-            decoded_data = data.decode("utf-8")
-            logger.info(f"Début des données décodées: {decoded_data[:200]}...")
-            return json.loads(decoded_data)
-        else:
-            error_msg = data.decode("utf-8")
-            logger.error(f"Erreur API (Status {response.status}): {error_msg}")
-            raise Exception(f"Erreur API (Status {response.status}): {error_msg}")
-            
-    except http.client.HTTPException as e:
-        logger.error(f"Erreur HTTP lors de la requête: {str(e)}")
-        raise Exception(f"Erreur HTTP: {str(e)}")
-    except json.JSONDecodeError as e:
-        logger.error(f"Erreur de décodage JSON: {str(e)}")
-        raise Exception(f"Erreur de décodage JSON: {str(e)}")
-    except Exception as e:
-        logger.error(f"Erreur inattendue: {str(e)}")
-        raise
-    finally:
-        if conn:
-            conn.close()
-
-@st.cache_data(ttl=3600)
-def get_backlinks_cached(target_url, limit=100, mode="subdomains", aggregation="all"):
-    """Version mise en cache de la requête de backlinks"""
-    try:
-        logger.info(f"Début de get_backlinks_cached pour URL: {target_url}")
-        
-        headers = {
-            'Accept': "application/json",
-            'Authorization': f"Bearer {AHREFS_API_KEY}"
-        }
-        
-        encoded_url = encode_url_for_ahrefs(target_url)
-        logger.info(f"URL encodée: {encoded_url}")
-        
-        endpoint = (f"/v3/site-explorer/all-backlinks?"
-                   f"limit={limit}&"
-                   f"select=domain_rating_source,url_from,first_seen,link_type&"
-                   f"target={encoded_url}&"
-                   f"mode={mode}&"
-                   f"history=live&"
-                   f"aggregation={aggregation}")
-        
-        logger.info(f"Endpoint construit: {endpoint}")
-        
-        result = make_ahrefs_request(endpoint, headers)
-        
-        if not result:
-            raise Exception("Aucun résultat retourné par l'API")
-            
-        logger.info(f"Résultat reçu avec {len(result.get('backlinks', []))} backlinks")
-        return result
-        
-    except Exception as e:
-        logger.error(f"Erreur dans get_backlinks_cached: {str(e)}")
-        raise Exception(f"Erreur lors de la récupération des backlinks: {str(e)}")
+logger = logging.getLogger(__name__)
 
-@st.cache_data(ttl=3600)
+@st.cache_data(ttl=OUR_DOMAIN_CACHE_TTL, max_entries=20, show_spinner=False)
 def get_our_domain_backlinks(our_domain, mode="subdomains"):
     """Récupère tous les backlinks déjà analysés pour notre domaine"""
-    headers = {
-        'Accept': "application/json",
-        'Authorization': f"Bearer {AHREFS_API_KEY}"
-    }
-    
-    encoded_url = encode_url_for_ahrefs(our_domain)
-    endpoint = (f"/v3/site-explorer/all-backlinks?"  # Changement ici
-               f"select=domain_rating_source,url_from,first_seen,link_type,url_to&"
-               f"target={encoded_url}&"
-               f"mode={mode}&"
-               f"history=live&"
-               f"aggregation=all")  # Ajout du paramètre aggregation
-    
-    logger.info(f"Requête pour notre domaine: {endpoint}")
-    return make_ahrefs_request(endpoint, headers)
-
-@st.cache_data(ttl=3600)
-def get_tier2_stats_cached(url):
-    """Version mise en cache des statistiques de niveau 2"""
-    try:
-        headers = {
-            'Accept': "application/json",
-            'Authorization': f"Bearer {AHREFS_API_KEY}"
-        }
-        
-        current_date = datetime.now().strftime("%Y-%m-%d")
-        encoded_url = url.replace(':', '%3A').replace('/', '%2F')
-        endpoint = f"/v3/site-explorer/backlinks-stats?target={encoded_url}&mode=exact&date={current_date}"
-        
-        stats = make_ahrefs_request(endpoint, headers)
-        
-        if not stats or 'metrics' not in stats:
-            logger.warning(f"Pas de métriques trouvées pour {url}")
-            return 0, 0
-            
-        live_backlinks = stats['metrics'].get('live', 0)
-        live_refdomains = stats['metrics'].get('live_refdomains', 0)
-        
-        return live_backlinks, live_refdomains
-        
-    except Exception as e:
-        logger.error(f"Erreur lors de l'analyse Tier 2 pour {url}: {str(e)}")
-        return 0, 0
-
-def analyze_tier2_links_parallel(df, progress_bar, status_text):
-    """Analyse parallèle des liens de niveau 2"""
-    tier2_results = []
-    total_urls = len(df)
-    
-    processed_lock = Lock()
-    processed_count = 0
-    
-    def process_url(url):
-        nonlocal processed_count
-        try:
-            result = get_tier2_stats_cached(url)
-            
-            with processed_lock:
-                nonlocal processed_count
-                processed_count += 1
-                
-            return result
-        except Exception as e:
-            logger.error(f"Erreur lors de l'analyse de {url}: {str(e)}")
-            return (0, 0)
-    
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [executor.submit(process_url, url) for url in df['url_from']]
-        
-        while any(not f.done() for f in futures):
-            current_progress = processed_count / total_urls
-            progress_bar.progress(current_progress)
-            status_text.text(f"Analyse de l'URL {processed_count}/{total_urls}")
-            time.sleep(0.1)
-        
-        tier2_results = [f.result() for f in futures]
-    
-    progress_bar.progress(1.0)
-    status_text.text(f"Analyse terminée! {total_urls}/{total_urls} URLs traitées")
-    
-    tier2_live_links, tier2_live_refdomains = zip(*tier2_results)
-    return list(tier2_live_links), list(tier2_live_refdomains)
-
-def analyze_dr_distribution(df):
-    """Analyse la distribution des Domain Ratings"""
-    dr_ranges = {
-        'DR 0-29': (0, 29),
-        'DR 30-44': (30, 44),
-        'DR 45-59': (45, 59),
-        'DR 60-100': (60, 100)
-    }
-    
-    distribution = {}
-    for range_name, (min_dr, max_dr) in dr_ranges.items():
-        count = len(df[(df['domain_rating_source'] >= min_dr) & 
-                      (df['domain_rating_source'] <= max_dr)])
-        distribution[range_name] = count
-    
-    return distribution
-
-def analyze_yearly_distribution(df):
-    """Analyse la distribution des backlinks par année"""
-    df['year'] = pd.to_datetime(df['first_seen']).dt.year
-    yearly_counts = df['year'].value_counts().sort_index()
-    cumulative_counts = yearly_counts.cumsum()
-    
-    yearly_data = pd.DataFrame({
-        'Année': yearly_counts.index,
-        '# de liens': yearly_counts.values,
-        'CUMULÉS': cumulative_counts.values
-    })
-    
-    return yearly_data.sort_values('Année')
-
-def analyze_tier_distribution(df, column_name):
-    """Analyse la distribution des Tiers"""
-    if column_name not in df.columns:
-        return {
-            f'0 {column_name}': 0,
-            f'1-3 {column_name}': 0,
-            f'4-10 {column_name}': 0,
-            f'11+ {column_name}': 0
-        }
-    
-    tier_ranges = {
-        f'0 {column_name}': (0, 0),
-        f'1-3 {column_name}': (1, 3),
-        f'4-10 {column_name}': (4, 10),
-        f'11+ {column_name}': (11, float('inf'))
+    # Seule l'URL source sert à la comparaison : réponse et entrée de cache réduites
+    params = {
+        'select': 'url_from',
+        'target': normalize_url_for_ahrefs(our_domain),
+        'mode': mode,
+        'history': 'live',
+        'aggregation': 'all'
     }
     
-    distribution = {}
-    for range_name, (min_links, max_links) in tier_ranges.items():
-        if min_links == max_links:
-            count = len(df[df[column_name] == min_links])
-        elif max_links == float('inf'):
-            count = len(df[df[column_name] >= min_links])
-        else:
-            count = len(df[(df[column_name] >= min_links) & 
-                         (df[column_name] <= max_links)])
-        distribution[range_name] = count
-    
-    return distribution
-
-def get_max_metrics(df):
-    """Obtient les métriques maximales"""
-    if len(df) == 0:
-        return {
-            'max_dr': 0,
-            'max_tier': 0,
-            'max_dr_url': '',
-            'max_dr_value': 0
-        }
-    
-    max_dr_idx = df['domain_rating_source'].idxmax()
-    
-    return {
-        'max_dr': df['domain_rating_source'].max(),
-        'max_tier': df.get('tier2_live_links', [0]).max() if 'tier2_live_links' in df.columns else 0,
-        'max_dr_url': df.loc[max_dr_idx, 'url_from'],
-        'max_dr_value': df.loc[max_dr_idx, 'domain_rating_source']
-    }
-
-def create_yearly_plot(yearly_data, title="Nombre de domaines Référents par années"):
-    """Crée un graphique des backlinks par année"""
-    fig = go.Figure()
-    
-    fig.add_trace(
-        go.Scatter(
-            x=yearly_data['Année'],
-            y=yearly_data['# de liens'],
-            name='# de backlinks',
-            mode='lines+markers'
-        )
-    )
-    
-    fig.update_layout(
-        title=title,
-        xaxis_title='Année',
-        yaxis_title='Nombre de backlinks',
-        height=400,
-        showlegend=True
-    )
-    
-    return fig
+    logger.debug("Requête pour notre domaine: %s", params)
+    return make_ahrefs_request(AHREFS_BACKLINKS_PATH, params)
 
 def analyze_domain_overlap(current_backlinks, our_backlinks):
     """Analyse le chevauchement entre les backlinks"""
-    current_df = pd.DataFrame(current_backlinks)
-    our_df = pd.DataFrame(our_backlinks)
+    # Schéma typé même sans backlinks : les colonnes existent toujours
+    current_df = backlinks_to_dataframe(current_backlinks)
     
-    current_domains = set(current_df['url_from'])
-    our_domains = set(our_df['url_from'])
+    # URLs sources distinctes comparées par opérations d'Index, sans second DataFrame pour nos backlinks
+    current_domains = pd.Index(current_df['url_from']).unique()
+    our_domains = pd.Index([backlink['url_from'] for backlink in our_backlinks]).unique()
     
     shared_domains = current_domains.intersection(our_domains)
-    unique_to_target = current_domains - our_domains
-    unique_to_us = our_domains - current_domains
+    unique_to_target = current_domains.difference(our_domains)
+    unique_to_us = our_domains.difference(current_domains)
     
     # Calcul des métriques moyennes pour les domaines partagés
     shared_df = current_df[current_df['url_from'].isin(shared_domains)]
@@ -347,7 +57,7 @@ def analyze_domain_overlap(current_backlinks, our_backlinks):
         'shared_count': len(shared_domains),
         'unique_to_target': len(unique_to_target),
         'unique_to_us': len(unique_to_us),
-        'shared_domains': list(shared_domains),
+        'shared_domains': shared_domains.tolist(),
         'avg_dr_shared': avg_dr,
         'shared_df': shared_df
     }
@@ -392,12 +102,16 @@ def main():
         if url_input:
             try:
                 with st.spinner("Récupération et analyse des backlinks en cours..."):
+                    # URLs normalisées avant les appels : « example.com » et « https://example.com »
+                    # partagent la même entrée de cache
+                    target_url = normalize_url_for_ahrefs(url_input)
+                    
                     # Récupération des backlinks de la cible
-                    target_result = get_backlinks_cached(url_input, limit, mode, aggregation)
+                    target_result = get_backlinks_cached(target_url, limit, mode, aggregation)
                     
                     # Si un domaine de référence est fourni, récupération de ses backlinks
                     if our_domain:
-                        our_result = get_our_domain_backlinks(our_domain, mode)
+                        our_result = get_our_domain_backlinks(normalize_url_for_ahrefs(our_domain), mode)
                         
                         if our_result and target_result:
                             overlap_analysis = analyze_domain_overlap(
@@ -433,23 +147,28 @@ def main():
                                 
                                 # Liste des domaines communs avec leurs métriques
                                 st.subheader("🤝 Liste des domaines en commun")
-                                shared_df = overlap_analysis['shared_df'].copy()
-                                shared_df = shared_df.sort_values('domain_rating_source', ascending=False)
+                                # sort_values renvoie déjà un nouveau DataFrame : pas de copie préalable
+                                shared_df = overlap_analysis['shared_df'].sort_values('domain_rating_source', ascending=False)
                                 
                                 st.dataframe(
                                     shared_df,
                                     column_config={
                                         "domain_rating_source": "DR Source",
                                         "url_from": "URL Source",
-                                        "first_seen": "Première vue",
+                                        # Même format ISO 8601 que le tableau détaillé
+                                        "first_seen": st.column_config.DatetimeColumn(
+                                            "Première vue", format="YYYY-MM-DDTHH:mm:ss[Z]"
+                                        ),
                                         "link_type": "Type de lien"
                                     },
                                     hide_index=True
                                 )
 
                     # Analyse des backlinks de la cible
-                    if target_result and 'backlinks' in target_result:
-                        df = pd.DataFrame(target_result['backlinks'])
+                    analysis = analyze_backlinks_cached(target_url, limit, mode, aggregation)
+                    
+                    if analysis:
+                        df = analysis['df']
                         
                         # Analyse des liens Tier 2 si demandé
                         if check_tier2 and len(df) > 0:
@@ -470,7 +189,7 @@ def main():
 
                         # Distribution temporelle
                         st.subheader("📅 Distribution temporelle des backlinks")
-                        yearly_data = analyze_yearly_distribution(df)
+                        yearly_data = analysis['yearly_data']
                         
                         st.markdown("### # de backlinks créés par année")
                         st.dataframe(
@@ -483,37 +202,34 @@ def main():
                             }
                         )
                         
-                        st.plotly_chart(create_yearly_plot(yearly_data))
+                        st.plotly_chart(analysis['yearly_plot'])
 
                         # Distribution des DR
                         st.subheader("📊 Nombre de Backlinks en fonction du DR")
-                        dr_distribution = analyze_dr_distribution(df)
-                        cols = st.columns(4)
-                        for i, (range_name, count) in enumerate(dr_distribution.items()):
-                            cols[i].metric(range_name, count)
+                        dr_distribution = analysis['dr_distribution']
+                        st.table(distribution_table(dr_distribution))
                         
                         # Distribution des Tiers
                         if 'tier2_live_links' in df.columns:
                             st.subheader("🔗 Distribution des liens de niveau 2")
                             
+                            # Backlinks et domaines référents comptés en un seul passage
+                            links_distribution, refdomains_distribution = analyze_tier_distributions(
+                                df, ['tier2_live_links', 'tier2_live_refdomains']
+                            )
+                            
                             # Backlinks
-                            links_distribution = analyze_tier_distribution(df, 'tier2_live_links')
-                            cols = st.columns(4)
-                            for i, (range_name, count) in enumerate(links_distribution.items()):
-                                cols[i].metric(
-                                    range_name.replace('tier2_live_links', 'Live backlinks Tier2'),
-                                    count
-                                )
+                            st.table(distribution_table({
+                                range_name.replace('tier2_live_links', 'Live backlinks Tier2'): count
+                                for range_name, count in links_distribution.items()
+                            }))
                             
                             # Referring domains
                             st.subheader("🔗 Distribution des domaines référents de niveau 2")
-                            refdomains_distribution = analyze_tier_distribution(df, 'tier2_live_refdomains')
-                            cols = st.columns(4)
-                            for i, (range_name, count) in enumerate(refdomains_distribution.items()):
-                                cols[i].metric(
-                                    range_name.replace('tier2_live_refdomains', 'RD Tier2'),
-                                    count
-                                )
+                            st.table(distribution_table({
+                                range_name.replace('tier2_live_refdomains', 'RD Tier2'): count
+                                for range_name, count in refdomains_distribution.items()
+                            }))
 
                         # Métriques maximales
                         st.subheader("🏆 Métriques Maximales")
@@ -532,7 +248,10 @@ def main():
                         column_config = {
                             "domain_rating_source": "DR Source",
                             "url_from": "URL Source",
-                            "first_seen": "Première vue",
+                            # Dates affichées au format ISO 8601 d'Ahrefs, comme dans l'export CSV
+                            "first_seen": st.column_config.DatetimeColumn(
+                                "Première vue", format="YYYY-MM-DDTHH:mm:ss[Z]"
+                            ),
                             "link_type": "Type de lien"
                         }
                         
@@ -548,18 +267,18 @@ def main():
                             hide_index=True
                         )
                         
-                        # Export CSV
-                        csv = df.to_csv(index=False)
+                        # Export CSV : fichier généré au clic, sans relancer le script
                         st.download_button(
                             "💾 Télécharger les données (CSV)",
-                            csv,
+                            partial(dataframe_to_csv, df),
                             f"backlinks_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-                            "text/csv"
+                            "text/csv",
+                            on_click="ignore"
                         )
                     else:
                         st.error("Erreur lors de la récupération des données. Vérifiez l'URL et réessayez.")
             except Exception as e:
-                logger.error(f"Erreur lors de l'analyse: {str(e)}")
+                logger.error("Erreur lors de l'analyse: %s", e)
                 st.error(f"Une erreur s'est produite: {str(e)}")
         else:
             st.warning("Veuillez entrer une URL à analyser.")